@@ -1,8 +1,15 @@
-from flask import Flask, Response, request, jsonify, redirect, url_for
-import random, os
+from flask import Flask, Response, request, redirect, abort
+import random, os, re, time, gzip, uuid
+from collections import deque
+from functools import lru_cache
 from datetime import datetime
+import orjson, redis, brotli
+from flask_compress import Compress
 
 app = Flask(__name__)
+app.config['COMPRESS_MIMETYPES'] = ['image/svg+xml', 'application/json', 'text/html']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+compress = Compress(app)
 
 CELL_SIZE = 20
 BOARD_WIDTH = 20
@@ -15,112 +22,270 @@ COLORS = {
     'grid': '#21262d'
 }
 
-game_state = None
+DELTAS = {'up': (0, -1), 'down': (0, 1), 'left': (-1, 0), 'right': (1, 0)}
+OPPOSITE = {'up': 'down', 'down': 'up', 'left': 'right', 'right': 'left'}
+
+GAME_TTL = 3600
+
+def occupancy(snake):
+    # one bit per cell, bit y*BOARD_WIDTH+x set when the snake covers (x, y)
+    occ = 0
+    for x, y in snake:
+        occ |= 1 << (y*BOARD_WIDTH + x)
+    return occ
 
 def get_initial_state():
+    snake = deque([(10, 7), (9, 7), (8, 7)])
     return {
         "board": [BOARD_WIDTH, BOARD_HEIGHT],
-        "snake": [[10, 7], [9, 7], [8, 7]],
+        "game_id": None,  # assigned when the game is first saved
+        "snake": snake,
+        "occ": occupancy(snake),
         "dir": "right",
-        "food": [15, 7],
+        "food": (15, 7),
         "score": 0,
         "game_over": False,
-        "last_move": datetime.now().isoformat()
+        "move_count": 0,
+        "last_move_ts": None  # no move yet
     }
 
-def generate_food(snake, board_w, board_h):
-    while True:
-        x = random.randint(0, board_w - 1)
-        y = random.randint(0, board_h - 1)
-        if [x, y] not in snake:
-            return [x, y]
+# keyed by the occupancy bitmap; every restart asks for the same opening board
+@lru_cache(maxsize=1024)
+def _free_cells(occ):
+    return tuple(i for i in range(BOARD_WIDTH*BOARD_HEIGHT) if not (occ >> i) & 1)
+
+def generate_food(occ):
+    # pick uniformly among free cells; bounded work however long the snake gets
+    free = _free_cells(occ)
+    if not free:
+        return None  # the snake fills the board
+    idx = random.choice(free)
+    return (idx % BOARD_WIDTH, idx // BOARD_WIDTH)
 
 def move_snake(state, direction):
     if state.get('game_over'):
         return state
-    snake = state['snake'][:]
-    head = snake[0][:]
-    valid_moves = {
-        'up': state['dir'] != 'down',
-        'down': state['dir'] != 'up', 
-        'left': state['dir'] != 'right',
-        'right': state['dir'] != 'left'
-    }
-    if direction in valid_moves and valid_moves[direction]:
+    # every call past this point changes the board, game-over included
+    state['move_count'] += 1
+    snake = state['snake']
+    if direction in DELTAS and OPPOSITE[state['dir']] != direction:
         state['dir'] = direction
-    if state['dir'] == 'up': head[1] -= 1
-    elif state['dir'] == 'down': head[1] += 1
-    elif state['dir'] == 'left': head[0] -= 1
-    elif state['dir'] == 'right': head[0] += 1
-    if (head[0] < 0 or head[0] >= BOARD_WIDTH or head[1] < 0 or head[1] >= BOARD_HEIGHT or head in snake):
+    dx, dy = DELTAS[state['dir']]
+    x, y = snake[0][0] + dx, snake[0][1] + dy
+    if not (0 <= x < BOARD_WIDTH and 0 <= y < BOARD_HEIGHT) or (state['occ'] >> (y*BOARD_WIDTH + x)) & 1:
         state['game_over'] = True
         return state
-    snake.insert(0, head)
+    head = (x, y)
+    snake.appendleft(head)
+    state['occ'] |= 1 << (y*BOARD_WIDTH + x)
     if head == state['food']:
         state['score'] += 10
-        state['food'] = generate_food(snake, BOARD_WIDTH, BOARD_HEIGHT)
+        state['food'] = generate_food(state['occ'])
+        if state['food'] is None:
+            # nowhere left to put food: the game is won
+            state['game_over'] = True
     else:
-        snake.pop()
-    state['snake'] = snake
-    state['last_move'] = datetime.now().isoformat()
+        tx, ty = snake.pop()
+        state['occ'] &= ~(1 << (ty*BOARD_WIDTH + tx))
+    state['last_move_ts'] = time.time()
     return state
 
-def render_svg(state):
+def encode_state(state):
+    # orjson caps ints at 64 bits, so the bitmap is rebuilt on load rather than
+    # stored; default=list writes the snake deque as [[x, y], ...] without a copy
+    return orjson.dumps({k: v for k, v in state.items() if k != 'occ'}, default=list)
+
+def decode_state(raw):
+    state = orjson.loads(raw)
+    state['snake'] = deque(map(tuple, state['snake']))
+    state['occ'] = occupancy(state['snake'])
+    state['food'] = tuple(state['food']) if state['food'] is not None else None
+    return state
+
+class GameStore:
+    """Game state per board, kept in Redis so every worker sees the same snake."""
+
+    def __init__(self, pool, ttl=GAME_TTL):
+        self.redis = redis.Redis(connection_pool=pool)
+        self.ttl = ttl
+
+    def key(self, board_id):
+        return f'snake:game:{board_id}'
+
+    def load(self, board_id):
+        raw = self.redis.get(self.key(board_id))
+        return decode_state(raw) if raw is not None else get_initial_state()
+
+    def update(self, board_id, fn):
+        # WATCH/MULTI/EXEC: retried by redis-py if another /move lands in between
+        key = self.key(board_id)
+        def txn(pipe):
+            raw = pipe.get(key)
+            state = fn(decode_state(raw) if raw is not None else get_initial_state())
+            if not state.get('game_id'):
+                # first write of a game, whether after a restart or on a fresh (or expired) key
+                state['game_id'] = uuid.uuid4().hex[:12]
+            pipe.multi()
+            pipe.setex(key, self.ttl, encode_state(state))
+            return state
+        return self.redis.transaction(txn, key, value_from_callable=True)
+
+store = GameStore(redis.ConnectionPool.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0')))
+
+def ojson(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+BOARD_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+def get_board_id():
+    # ?board= picks a separate game; everyone else (README embeds loaded through
+    # cookieless image proxies included) plays the shared default board
+    board = request.args.get('board', 'default')
+    if not BOARD_ID.fullmatch(board):
+        abort(ojson({'error': 'Invalid board'}, 400))
+    return board
+
+def _build_static_prefix():
     width, height = BOARD_WIDTH*CELL_SIZE, BOARD_HEIGHT*CELL_SIZE
-    svg = f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">'
-    svg += f'<rect width="{width}" height="{height}" fill="{COLORS["bg"]}"/>'
-    # grid lines
-    for x in range(0, width+1, CELL_SIZE):
-        svg += f'<line x1="{x}" y1="0" x2="{x}" y2="{height}" stroke="{COLORS["grid"]}" stroke-width="1" opacity="0.1"/>'
-    for y in range(0, height+1, CELL_SIZE):
-        svg += f'<line x1="0" y1="{y}" x2="{width}" y2="{y}" stroke="{COLORS["grid"]}" stroke-width="1" opacity="0.1"/>'
-    # food
-    fx, fy = state['food']
-    svg += f'<rect x="{fx*CELL_SIZE+2}" y="{fy*CELL_SIZE+2}" width="{CELL_SIZE-4}" height="{CELL_SIZE-4}" fill="{COLORS["food"]}" rx="3"/>'
+    return "".join([
+        f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">',
+        # grid: one tiled cell outline instead of a <line> per row and column;
+        # stroke is 2 because the tile clips half of it away
+        f'<defs><pattern id="g" width="{CELL_SIZE}" height="{CELL_SIZE}" patternUnits="userSpaceOnUse">'
+        f'<path d="M {CELL_SIZE} 0 L 0 0 0 {CELL_SIZE}" fill="none" stroke="{COLORS["grid"]}" stroke-width="2"/>'
+        '</pattern></defs>',
+        f'<rect width="{width}" height="{height}" fill="{COLORS["bg"]}"/>',
+        f'<rect width="{width}" height="{height}" fill="url(#g)" opacity="0.1"/>',
+    ])
+
+# header, background and grid only depend on the board constants
+_SVG_PREFIX = _build_static_prefix()
+
+# per-segment fill and opacity, indexed by position from the head
+_SEGMENT_COLOR = [COLORS['head']] + [COLORS['snake']] * (BOARD_WIDTH*BOARD_HEIGHT)
+_OPACITY = ['1.0'] + [f'{max(0.6, 1.0-i*0.05)}' for i in range(1, BOARD_WIDTH*BOARD_HEIGHT+1)]
+
+def _board_parts(snake, food):
+    parts = [_SVG_PREFIX]
+    # food (None once the snake has filled the board)
+    if food is not None:
+        fx, fy = food
+        parts.append(f'<rect x="{fx*CELL_SIZE+2}" y="{fy*CELL_SIZE+2}" width="{CELL_SIZE-4}" height="{CELL_SIZE-4}" fill="{COLORS["food"]}" rx="3"/>')
     # snake
-    for i, (sx, sy) in enumerate(state['snake']):
-        color = COLORS['head'] if i==0 else COLORS['snake']
-        opacity = '1.0' if i==0 else f'{max(0.6, 1.0-i*0.05)}'
-        svg += f'<rect x="{sx*CELL_SIZE+1}" y="{sy*CELL_SIZE+1}" width="{CELL_SIZE-2}" height="{CELL_SIZE-2}" fill="{color}" opacity="{opacity}" rx="2"/>'
-    if state.get('game_over'):
-        svg += f'<rect x="0" y="0" width="{width}" height="{height}" fill="black" opacity="0.7"/>'
-        svg += f'<text x="{width//2}" y="{height//2-20}" text-anchor="middle" fill="white" font-size="24" font-weight="bold">GAME OVER</text>'
-        svg += f'<text x="{width//2}" y="{height//2+10}" text-anchor="middle" fill="white" font-size="16">Score: {state["score"]}</text>'
-    else:
-        svg += f'<text x="10" y="{height-10}" fill="{COLORS["snake"]}" font-size="14" font-weight="bold">Score: {state["score"]}</text>'
-    svg += '</svg>'
-    return svg
+    for i, (sx, sy) in enumerate(snake):
+        parts.append(f'<rect x="{sx*CELL_SIZE+1}" y="{sy*CELL_SIZE+1}" width="{CELL_SIZE-2}" height="{CELL_SIZE-2}" fill="{_SEGMENT_COLOR[i]}" opacity="{_OPACITY[i]}" rx="2"/>')
+    return parts
+
+# each path is cached on its own; the bodies are encoded once so Response
+# doesn't re-encode them on every hit
+@lru_cache(maxsize=256)
+def _render_playing(snake, food, score):
+    height = BOARD_HEIGHT*CELL_SIZE
+    parts = _board_parts(snake, food)
+    parts.append(f'<text x="10" y="{height-10}" fill="{COLORS["snake"]}" font-size="14" font-weight="bold">Score: {score}</text>')
+    parts.append('</svg>')
+    return "".join(parts).encode('ascii')
+
+@lru_cache(maxsize=64)
+def _render_gameover(snake, food, score):
+    width, height = BOARD_WIDTH*CELL_SIZE, BOARD_HEIGHT*CELL_SIZE
+    title = 'YOU WIN' if food is None else 'GAME OVER'
+    parts = _board_parts(snake, food)
+    parts.extend([
+        f'<rect x="0" y="0" width="{width}" height="{height}" fill="black" opacity="0.7"/>',
+        f'<text x="{width//2}" y="{height//2-20}" text-anchor="middle" fill="white" font-size="24" font-weight="bold">{title}</text>',
+        f'<text x="{width//2}" y="{height//2+10}" text-anchor="middle" fill="white" font-size="16">Score: {score}</text>',
+        '</svg>',
+    ])
+    return "".join(parts).encode('ascii')
+
+# args are hashable so repeat fetches of an unchanged board skip rendering
+def render_svg(snake, food, score, game_over):
+    return (_render_gameover if game_over else _render_playing)(snake, food, score)
+
+def state_tag(state):
+    # move_count restarts at 0 when a key expires, so the game id keeps tags from repeating;
+    # unsaved boards are all the same opening board and share "new"
+    return f'{state.get("game_id") or "new"}-{state["move_count"]}-{state["score"]}-{int(state["game_over"])}'
+
+def etag_matches(tag):
+    # Flask-Compress rewrites W/"tag" to W/"tag:br" (or :gzip) on compressed
+    # bodies and clients echo that back, so compare with the suffix removed
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return True
+    return any(t.split(':', 1)[0] == tag for t in if_none_match.as_set(include_weak=True))
+
+def choose_encoding():
+    # negotiate exactly like Flask-Compress does for every other route (q-values first,
+    # COMPRESS_ALGORITHM order on ties, identity and * handled the same)
+    return compress._choose_compress_algorithm(request.headers.get('Accept-Encoding', ''))
+
+# the rendered bytes come out of the render caches as the same objects, so
+# this lookup is cheap and Flask-Compress never re-runs brotli on a hit
+@lru_cache(maxsize=256)
+def compress_svg(svg, encoding, level):
+    # level is an argument (not read from app.config here) so it is part of the cache key
+    if encoding == 'br':
+        return brotli.compress(svg, mode=brotli.MODE_TEXT, quality=level)
+    return gzip.compress(svg, compresslevel=level)
 
 @app.route('/board.svg')
 def get_board_svg():
-    global game_state
-    if game_state is None:
-        game_state = get_initial_state()
-    svg = render_svg(game_state)
-    # Append timestamp to bust cache
-    timestamp = int(datetime.now().timestamp())
-    return Response(svg, mimetype='image/svg+xml', headers={"Cache-Control": f"no-store, must-revalidate, max-age=0", "ETag": str(timestamp)})
+    state = store.load(get_board_id())
+    tag = state_tag(state)
+    encoding = choose_encoding()
+    # no-cache (not no-store) so clients keep the board and revalidate with If-None-Match;
+    # compressed bodies get the same :<encoding> ETag suffix Flask-Compress would add
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding",
+               "ETag": f'W/"{tag}:{encoding}"' if encoding else f'W/"{tag}"'}
+    if etag_matches(tag):
+        return Response(status=304, headers=headers)
+    svg = render_svg(tuple(state['snake']), state['food'], state['score'], state['game_over'])
+    if encoding:
+        # an existing Content-Encoding makes Flask-Compress pass the body through
+        level = app.config['COMPRESS_BR_LEVEL' if encoding == 'br' else 'COMPRESS_LEVEL']
+        svg = compress_svg(svg, encoding, level)
+        headers['Content-Encoding'] = encoding
+    return Response(svg, mimetype='image/svg+xml', headers=headers)
 
 @app.route('/move/<direction>')
 def move_game(direction):
-    global game_state
-    if game_state is None:
-        game_state = get_initial_state()
-    if game_state.get('game_over'):
-        game_state = get_initial_state()
-        game_state['dir'] = direction
-        game_state['food'] = generate_food(game_state['snake'], BOARD_WIDTH, BOARD_HEIGHT)
-    if direction not in ['up','down','left','right']:
-        return jsonify({'error':'Invalid direction'}),400
-    game_state = move_snake(game_state, direction)
+    if direction not in DELTAS:
+        return ojson({'error':'Invalid direction'}, 400)
+    def apply_move(state):
+        if state.get('game_over'):
+            # keep counting across restarts so a new game never reuses an old ETag
+            state.update(get_initial_state(), move_count=state['move_count'] + 1)
+            state['dir'] = direction
+            state['food'] = generate_food(state['occ'])
+        return move_snake(state, direction)
+    game_state = store.update(get_board_id(), apply_move)
     redirect_url = request.args.get('redirect')
     if redirect_url:
         return redirect(redirect_url, code=303)
-    return jsonify({'success': True, 'direction': direction, 'score': game_state['score'], 'game_over': game_state['game_over']})
+    return ojson({'success': True, 'direction': direction, 'score': game_state['score'], 'game_over': game_state['game_over']})
+
+# serialized once per distinct status, like the SVG renders
+@lru_cache(maxsize=256)
+def status_json(score, direction, game_over, length, last_move_ts):
+    # formatted here rather than on every move; /status is the only reader
+    last_move = datetime.fromtimestamp(last_move_ts).isoformat() if last_move_ts is not None else None
+    return orjson.dumps({'score': score, 'direction': direction, 'game_over': game_over,
+                         'length': length, 'last_move': last_move})
+
+@app.route('/status')
+def get_status():
+    state = store.load(get_board_id())
+    tag = state_tag(state)
+    headers = {"Cache-Control": "no-cache", "ETag": f'W/"{tag}"'}
+    if etag_matches(tag):
+        return Response(status=304, headers=headers)
+    body = status_json(state['score'], state['dir'], state['game_over'], len(state['snake']), state.get('last_move_ts'))
+    return Response(body, mimetype='application/json', headers=headers)
 
-# status, reset, home unchanged
+# reset, home unchanged
 
+# local development only; production runs under gunicorn (see Procfile)
 if __name__ == '__main__':
-    game_state = get_initial_state()
-    game_state['food'] = generate_food(game_state['snake'], BOARD_WIDTH, BOARD_HEIGHT)
-    app.run(host='0.0.0.0', port=int(os.environ.get('PORT',5000)), debug=True)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT',5000)), debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as snake
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(snake, 'store', snake.GameStore(fakeredis.FakeRedis().connection_pool))
+    return snake.app.test_client()
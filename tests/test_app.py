@@ -0,0 +1,99 @@
+import gzip
+
+import brotli
+
+import app as snake
+
+
+def test_board_revalidates_with_compressed_etag(client):
+    first = client.get('/board.svg', headers={'Accept-Encoding': 'gzip, br'})
+    assert first.status_code == 200
+    assert first.headers['Content-Encoding'] == 'br'
+    assert first.headers['ETag'] == 'W/"new-0-0-0:br"'
+
+    again = client.get('/board.svg', headers={'Accept-Encoding': 'gzip, br',
+                                               'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+def test_board_if_none_match_list_and_star(client):
+    etag = client.get('/board.svg').headers['ETag']
+    assert client.get('/board.svg', headers={'If-None-Match': f'W/"x", {etag}'}).status_code == 304
+    assert client.get('/board.svg', headers={'If-None-Match': '*'}).status_code == 304
+
+
+def test_board_etag_changes_after_move(client):
+    etag = client.get('/board.svg').headers['ETag']
+    client.get('/move/up')
+    assert client.get('/board.svg', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_restart_that_dies_at_once_changes_etag(client):
+    for _ in range(8):
+        client.get('/move/up')
+    etag = client.get('/board.svg').headers['ETag']
+    client.get('/move/left')
+    assert client.get('/board.svg', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_filling_the_board_wins_the_game(client):
+    # serpentine path over every cell: the snake covers all but the last, which holds the food
+    cells = [(x, y) for y in range(snake.BOARD_HEIGHT)
+             for x in (range(snake.BOARD_WIDTH) if y % 2 == 0 else reversed(range(snake.BOARD_WIDTH)))]
+    state = snake.get_initial_state()
+    state.update(snake=cells[-2::-1], food=cells[-1], dir='right')
+    snake.store.redis.set(snake.store.key('default'), snake.encode_state(state))
+
+    assert snake.generate_food((1 << snake.BOARD_WIDTH*snake.BOARD_HEIGHT) - 1) is None
+    moved = client.get('/move/right')
+    assert moved.status_code == 200
+    assert moved.get_json()['game_over'] is True
+    assert b'YOU WIN' in client.get('/board.svg').data
+
+
+def test_status_is_stable_before_the_first_move(client):
+    first, second = client.get('/status'), client.get('/status')
+    assert first.get_json()['last_move'] is None
+    assert first.data == second.data
+    client.get('/move/up')
+    assert client.get('/status').get_json()['last_move'] is not None
+
+
+def test_compressed_board_is_cached(client):
+    snake.compress_svg.cache_clear()
+    for _ in range(3):
+        br = client.get('/board.svg', headers={'Accept-Encoding': 'br'})
+    gz = client.get('/board.svg', headers={'Accept-Encoding': 'gzip'})
+    plain = client.get('/board.svg', headers={'Accept-Encoding': ''})
+    assert br.headers['Content-Encoding'] == 'br' and gz.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert brotli.decompress(br.data) == gzip.decompress(gz.data) == plain.data
+    assert snake.compress_svg.cache_info().hits == 2
+
+
+def test_expired_game_does_not_reuse_etag(client):
+    for _ in range(3):
+        client.get('/move/up')
+    etag = client.get('/board.svg').headers['ETag']
+    snake.store.redis.flushall()  # same as the key hitting GAME_TTL
+    for _ in range(3):
+        client.get('/move/down')
+    assert client.get('/board.svg').headers['ETag'] != etag
+    assert client.get('/board.svg', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_board_encoding_follows_client_q_values(client):
+    gz = client.get('/board.svg', headers={'Accept-Encoding': 'br;q=0.1, gzip'})
+    assert gz.headers['Content-Encoding'] == 'gzip'
+    assert gz.headers['ETag'].endswith(':gzip"')
+    plain = client.get('/board.svg', headers={'Accept-Encoding': 'identity, br;q=0.5'})
+    assert 'Content-Encoding' not in plain.headers
+
+
+def test_compress_level_change_is_not_masked_by_cache(client, monkeypatch):
+    fast = client.get('/board.svg', headers={'Accept-Encoding': 'br'}).data
+    monkeypatch.setitem(snake.app.config, 'COMPRESS_BR_LEVEL', 11)
+    best = client.get('/board.svg', headers={'Accept-Encoding': 'br'}).data
+    assert brotli.decompress(fast) == brotli.decompress(best)
+    assert fast != best